@@ -1,17 +1,151 @@
+import hashlib
+import json
+import pickle
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import pandas as pd
 import requests
 from owslib.wfs import WebFeatureService
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+_CACHE_DIR = Path.home() / ".cache" / "tilelayer_finder"
+# bump when the parsing or the format of the cached layers dicts changes to invalidate old caches
+_LAYERS_CACHE_VERSION = 1
+
+_CURRENT_FILE_RE = re.compile(r"(?<=Current live file:\s<a\shref=\")(.*)(?=\")")
+_LAYER_DEF_RE = re.compile(
+    r"var\s+(\w+)\s*=\s*(new\s*ol.layer.(Tile|Group)\(.*?)\);", re.DOTALL
+)
+_TITLE_RE = re.compile(r"(?<=title:)\s*[\"|\'](.*)(?=[\"|\'],)")
+_TYPENAME_RE = re.compile(r"(?<=typename:)\s*[\"|\'](.*)(?=[\"|\'],)")
+# captures are lazy so a match can't swallow other fields defined on the same line
+_TILE_FIELDS_RE = re.compile(
+    r"title:\s*[\"|\'](?P<title>.*?)(?=[\"|\'],)"
+    r"|typename:\s*[\"|\'](?P<typename>.*?)(?=[\"|\'],)"
+    r"|url:\s*[\"|\'](?P<xyz>.*?[png|jpg])(?=[\"|\'],)"
+    r"|maxZ:\s*(?P<max_z>\d+)"
+)
+_LAYERS_RE = re.compile(r"(?<=layers:)\s*\[\s*(.*)(?=\s*\],)")
+
+
+def _strip_js_comments(body: str) -> str:
+    """Remove commented out (``//``) lines from a block of javascript."""
+    return "".join(
+        line for line in body.splitlines(True) if not line.lstrip().startswith("//")
+    )
+
+
+def _find_xyz_source(body: str) -> tuple[int, int] | None:
+    """Find the start and end of the options passed to `ol.source.XYZ` in a layer definition."""
+    start = body.find("ol.source.XYZ({")
+    if start == -1:
+        return None
+    start += len("ol.source.XYZ({")
+    end = body.rfind("}),", start)
+    if end == -1:
+        return None
+    return start, end
+
+
+def _minify_json(data: bytes) -> bytes:
+    """Re-serialize JSON without whitespace (using ``orjson`` if it is installed).
+
+    The output of ``orjson`` and ``json`` is equivalent but not always byte-identical, e.g. ``0.00001`` vs ``1e-05``.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(orjson.loads(data))
+        except orjson.JSONDecodeError:
+            # orjson is stricter than json (e.g. it rejects NaN), so fall back rather than fail
+            pass
+    return json.dumps(
+        json.loads(data), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def _iter_layer_definitions(response: requests.Response, chunk_size: int = 65536):
+    """Yield layer definitions (matches of `_LAYER_DEF_RE`) from a streamed response as they are downloaded."""
+    response.encoding = "utf-8"
+
+    buffer = ""
+    for chunk in response.iter_content(chunk_size=chunk_size, decode_unicode=True):
+        buffer += chunk
+        yield from _LAYER_DEF_RE.finditer(buffer)
+        # definitions end at ");" so anything still incomplete starts after the last one
+        buffer = buffer[buffer.rfind(");") + 1 :]
+
+
+def _with_extension(fname: str, file_format: str) -> str:
+    """Add the file extension for `file_format` to `fname` (replacing ".csv") if it is missing."""
+    extension = f".{file_format}"
+    if fname.endswith(extension):
+        return fname
+    return f"{fname.removesuffix('.csv')}{extension}"
+
+
+def _write_data(data: pd.DataFrame, fname: str, file_format: str):
+    """Write a dataframe to a csv or parquet file."""
+    if file_format == "parquet":
+        data.to_parquet(fname, compression="zstd")
+    else:
+        data.to_csv(fname)
+
+
+def _read_data(fname: str) -> pd.DataFrame:
+    """Read a dataframe from a csv or parquet file (based on its file extension)."""
+    if fname.endswith(".parquet"):
+        return pd.read_parquet(fname)
+    return pd.read_csv(fname, index_col=0)
+
 
 class TileLayerFinder:
     """For finding tilelayers available from the NLS."""
 
-    def __init__(self):
-        """For finding tilelayers available from the NLS."""
-        self.get_wfs()
+    def __init__(self, cache: bool | None = True):
+        """For finding tilelayers available from the NLS.
+
+        Parameters
+        ----------
+        cache : bool, optional
+            Whether to cache responses from the NLS in "~/.cache/tilelayer_finder/nls_cache.sqlite" (requires ``requests-cache``).
+            Cached responses are revalidated using their ETag/Last-Modified headers.
+            The .js file itself is not stored (so it can be streamed), but the layers found in each version of it are cached in "~/.cache/tilelayer_finder".
+            By default, True.
+
+        Notes
+        -----
+        The WFS is fetched in the background, so any errors connecting to it are raised later,
+        when it is first needed (i.e. by `get_data(clean=True)` or `create_metadata_json`).
+        """
+        self.cache = cache
+        self.session = requests.Session()
+        if cache and requests_cache is not None:
+            try:
+                self.session = requests_cache.CachedSession(
+                    str(_CACHE_DIR / "nls_cache"),
+                    backend="sqlite",
+                    cache_control=True,
+                    expire_after=3600,
+                    # don't store the .js file so it can be streamed (the layers parsed from it are cached instead)
+                    filter_fn=lambda response: not response.url.endswith(".js"),
+                )
+            except OSError as err:
+                print(f"[WARNING] Unable to create response cache, not caching: {err}")
         self.queries = {}
+        # fetch the WFS in the background, it is only needed when cleaning data or creating metadata
+        self.get_wfs(wait=False)
 
     def get_data(self, clean: bool | None = True):
         """Gets the data and saves to `self.tile_data`.
@@ -28,10 +162,9 @@ class TileLayerFinder:
 
     def _find_current_file(self):
         """Find the url of the current live .js file and save to `self.current_file`."""
-        with requests.get("https://maps.nls.uk/geo/version") as response:
-            current_file = re.findall(
-                r"(?<=Current live file:\s<a\shref=\")(.*)(?=\")", response.text
-            )[0]
+        with self.session.get("https://maps.nls.uk/geo/version") as response:
+            response.encoding = "utf-8"  # NLS serves utf-8, avoid guessing the encoding
+            current_file = _CURRENT_FILE_RE.findall(response.text)[0]
             print(f"[INFO] Current file is: '{current_file}'")
             self.current_file = current_file
 
@@ -41,36 +174,66 @@ class TileLayerFinder:
         """
         current_file = self.current_file
 
-        with requests.get(current_file) as response:
-            all_layers = re.findall(r"(?<=var)\s*(.*?)\s*=\s*new", response.text)
-            all_layers_dict = {
-                layer: re.findall(
-                    rf"(?<=var\s{layer}\b)\s+=\s+(.*?)(?=\);)", response.text, re.DOTALL
-                )[0]
-                for layer in all_layers
-            }
-
-        tilelayers_dict = {
-            k: v
-            for k, v in all_layers_dict.items()
-            if re.search(r"new\s*ol.layer.Tile\(", v)
-        }
-
-        for k, v in tilelayers_dict.items():
-            tilelayers_dict[k] = re.sub(r"\n//.*", "", v)
+        tilelayers_dict = {}
+        group_layers_dict = {}
+        layers_dicts = {"Tile": tilelayers_dict, "Group": group_layers_dict}
+        with self.session.get(current_file, stream=True) as response:
+            # skip parsing if we have already seen this version of the file
+            cache_fname = None
+            etag = response.headers.get("ETag")
+            if self.cache and etag:
+                key = hashlib.sha256(
+                    f"{_LAYERS_CACHE_VERSION} {current_file} {etag}".encode()
+                ).hexdigest()
+                cache_fname = _CACHE_DIR / f"{key}.pkl"
+                if cache_fname.exists():
+                    try:
+                        with open(cache_fname, "rb") as f:
+                            cached_dicts = pickle.load(f)
+                        self.tilelayers_dict, self.group_layers_dict = cached_dicts
+                    except (
+                        OSError,
+                        pickle.UnpicklingError,
+                        EOFError,
+                        ValueError,
+                    ) as err:
+                        print(
+                            f"[WARNING] Unable to load layers from cache, re-parsing: {err}"
+                        )
+                    else:
+                        print(f"[INFO] Loaded layers from cache: '{cache_fname}'")
+                        return
+
+            # single pass over the file, sorting layers by type as they are found
+            for match in _iter_layer_definitions(response):
+                name, body, layer_type = match.groups()
+                # keep the first definition of each layer
+                if name in tilelayers_dict or name in group_layers_dict:
+                    continue
+                layers_dicts[layer_type][name] = _strip_js_comments(body)
 
         self.tilelayers_dict = tilelayers_dict
+        self.group_layers_dict = group_layers_dict
 
-        group_layers_dict = {
-            k: v
-            for k, v in all_layers_dict.items()
-            if re.search(r"new\s*ol.layer.Group\(", v)
-        }
-
-        for k, v in group_layers_dict.items():
-            group_layers_dict[k] = re.sub(r"\n//.*", "", v)
+        if cache_fname is not None:
+            self._cache_layers_dicts(cache_fname)
 
-        self.group_layers_dict = group_layers_dict
+    def _cache_layers_dicts(self, cache_fname: Path):
+        """Save `self.tilelayers_dict` and `self.group_layers_dict` to `cache_fname`, warning (not failing) if unable to."""
+        tmp_fname = None
+        try:
+            cache_fname.parent.mkdir(parents=True, exist_ok=True)
+            # write to a uniquely named temporary file first so interrupted or concurrent writes can't leave a broken cache
+            with tempfile.NamedTemporaryFile(
+                dir=cache_fname.parent, suffix=".tmp", delete=False
+            ) as f:
+                tmp_fname = Path(f.name)
+                pickle.dump((self.tilelayers_dict, self.group_layers_dict), f)
+            tmp_fname.replace(cache_fname)
+        except OSError as err:
+            print(f"[WARNING] Unable to cache layers: {err}")
+            if tmp_fname is not None:
+                tmp_fname.unlink(missing_ok=True)
 
     def _extract_data(self, clean: bool | None = True):
         """Extract data (name, title, typename, XYZ url, maxZ and layers) from layers dicts and save to `self.tile_data` and `self.group_data`.
@@ -80,108 +243,141 @@ class TileLayerFinder:
         clean : bool, optional
             Whether to clean up dataframes by removing duplicate and unavailable layers.
         """
-        tile_data_dict = {}
+        tile_rows = []
         for k, v in self.tilelayers_dict.items():
-            title = re.findall(r"(?<=title:)\s*[\"|\'](.*)(?=[\"|\'],)", v)
-            source_xyz = re.findall(
-                r"(?<=source:)\s*new\sol.source.XYZ\(\{(.*)(?=\}\),)", v, re.DOTALL
-            )
-            if len(source_xyz) > 0:
-                xyz = re.findall(
-                    r"(?<=url:)\s*[\"|\'](.*[png|jpg])(?=[\"|\'],)", source_xyz[0]
+            source_xyz = _find_xyz_source(v)
+            if source_xyz is None:
+                continue
+            xyz_start, xyz_end = source_xyz
+
+            # scan once for all fields, keeping the first value found for each
+            # url and maxZ come from the XYZ source (maxZ falls back to the whole layer)
+            fields = {}
+            for match in _TILE_FIELDS_RE.finditer(v):
+                field = match.lastgroup
+                if field in ("xyz", "max_z") and xyz_start <= match.start() < xyz_end:
+                    field = f"source_{field}"
+                fields.setdefault(field, match.group(match.lastgroup))
+
+            tile_rows.append(
+                (
+                    k,
+                    fields.get("title"),
+                    fields.get("typename"),
+                    fields.get("source_xyz"),
+                    fields.get("source_max_z", fields.get("max_z")),
                 )
-                max_z = re.findall(r"(?<=maxZ:)\s*(\d+)", source_xyz[0])
-                if len(max_z) == 0:
-                    max_z = re.findall(r"(?<=maxZ:)\s*(\d+)", v)
-                typename = re.findall(r"(?<=typename:)\s*[\"|\'](.*)(?=[\"|\'],)", v)
-                tile_data_dict[k] = [
-                    value[0] if len(value) != 0 else None
-                    for value in [title, typename, xyz, max_z]
-                ]
-
-        tile_data = pd.DataFrame.from_dict(
-            tile_data_dict,
-            orient="index",
-            columns=["Title", "Typename", "XYZ URL", "Max Z"],
+            )
+
+        tile_data = (
+            pd.DataFrame.from_records(
+                tile_rows, columns=["Name", "Title", "Typename", "XYZ URL", "Max Z"]
+            )
+            .set_index("Name")
+            .astype({"Max Z": "Int16"})
         )
 
-        group_data_dict = {}
+        group_rows = []
         for k, v in self.group_layers_dict.items():
-            title = re.findall(r"(?<=title:)\s*[\"|\'](.*)(?=[\"|\'],)", v)
-            typename = re.findall(r"(?<=typename:)\s*[\"|\'](.*)(?=[\"|\'],)", v)
-            layers = re.findall(r"(?<=layers:)\s*\[\s*(.*)(?=\s*\],)", v)
+            title = _TITLE_RE.findall(v)
+            typename = _TYPENAME_RE.findall(v)
+            layers = _LAYERS_RE.findall(v)
             if len(layers) != 0:
                 layers = layers[0].split(",")
                 layers = [layer.strip() for layer in layers]  # remove whitespace
-            group_data_dict[k] = [
-                title[0] if len(title) != 0 else None,
-                typename[0] if len(typename) != 0 else None,
-                layers,
-            ]
+            group_rows.append(
+                (
+                    k,
+                    title[0] if len(title) != 0 else None,
+                    typename[0] if len(typename) != 0 else None,
+                    layers,
+                )
+            )
 
-        group_data = pd.DataFrame.from_dict(
-            group_data_dict, orient="index", columns=["Title", "Typename", "Layers"]
-        )
+        group_data = pd.DataFrame.from_records(
+            group_rows, columns=["Name", "Title", "Typename", "Layers"]
+        ).set_index("Name")
 
         if clean:
-            # drop groups with missing layers
-            for i, row in group_data.iterrows():
-                if any(layer not in list(tile_data.index) for layer in row["Layers"]):
-                    group_data.drop(i, inplace=True)
+            # find groups with missing layers
+            group_layers = group_data["Layers"].explode().dropna()
+            missing_layers = group_layers[~group_layers.isin(tile_data.index)]
+            has_all_layers = ~group_data.index.isin(missing_layers.index)
 
             # remove 'nls:WFS' as these tend to be single maps rather than layers
-            tile_data = tile_data[tile_data["Typename"] != "nls:WFS"]
-            group_data = group_data[group_data["Typename"] != "nls:WFS"]
-
-            # ensure typename is available on WFS
-            for i, typename in tile_data["Typename"].items():
-                if typename not in list(self.wfs.contents):
-                    tile_data.drop(i, inplace=True)
-            for i, typename in group_data["Typename"].items():
-                if typename not in list(self.wfs.contents):
-                    group_data.drop(i, inplace=True)
-
-        tile_data.reset_index(inplace=True, names="Name")
+            # and ensure typename is available on WFS
+            tile_data = tile_data[
+                (tile_data["Typename"] != "nls:WFS")
+                & tile_data["Typename"].isin(self.wfs_contents)
+            ]
+            group_data = group_data[
+                has_all_layers
+                & (group_data["Typename"] != "nls:WFS")
+                & group_data["Typename"].isin(self.wfs_contents)
+            ]
+
+        tile_data.reset_index(inplace=True)
         print(f"[INFO] Tile dataframe has {len(tile_data)} values.")
         self.tile_data = tile_data
 
-        group_data.reset_index(inplace=True, names="Name")
+        group_data.reset_index(inplace=True)
         print(f"[INFO] Group dataframe has {len(group_data)} values.")
         self.group_data = group_data
 
+        self._index_data()
+
+    def _index_data(self):
+        """Map layer names to their data in `self.tile_data` and `self.group_data` and save to `self._tile_index` and `self._group_index`."""
+        # "Max Z" is Int16 after `get_data` but int/float after `load_data`, so normalise to int/None
+        self._tile_index = {
+            name: (typename, xyz, None if pd.isna(max_z) else int(max_z))
+            for name, typename, xyz, max_z in self.tile_data[
+                ["Name", "Typename", "XYZ URL", "Max Z"]
+            ].itertuples(index=False, name=None)
+        }
+        self._group_index = dict(
+            zip(self.group_data["Name"], self.group_data["Typename"], strict=True)
+        )
+
     def save_data(
         self,
         tiles_fname: str | None = "nls_tilelayers.csv",
         groups_fname: str | None = "nls_grouplayers.csv",
+        file_format: str | None = "csv",
     ):
-        """Save extracted data (`self.tile_data` and `self.group_data`) to csv file.
+        """Save extracted data (`self.tile_data` and `self.group_data`) to csv or parquet file.
 
         Parameters
         ----------
         tiles_fname : str, optional
-            The name to use when saving the file (should end in ".csv").
+            The name to use when saving the file (should end in ".csv" or ".parquet").
             By default, "nls_tilelayers.csv"
         groups_fname : str, optional
-            The name to use when saving the file (should end in ".csv")
+            The name to use when saving the file (should end in ".csv" or ".parquet")
             By default, "nls_grouplayers.csv"
+        file_format : str, optional
+            The format to save the data in, either "csv" or "parquet" (requires ``pyarrow``).
+            When saving to parquet, a ".csv" file extension is replaced with ".parquet".
+            By default, "csv".
         """
+        if file_format not in ("csv", "parquet"):
+            msg = f'[ERROR] Unknown file format "{file_format}", expected "csv" or "parquet".'
+            raise ValueError(msg)
 
-        if not tiles_fname.endswith(".csv"):
-            tiles_fname = f"{tiles_fname}.csv"
+        tiles_fname = _with_extension(tiles_fname, file_format)
         print(f"[INFO] Saving tile_data to '{tiles_fname}'.")
-        self.tile_data.to_csv(tiles_fname)
+        _write_data(self.tile_data, tiles_fname, file_format)
 
-        if not groups_fname.endswith(".csv"):
-            groups_fname = f"{groups_fname}.csv"
+        groups_fname = _with_extension(groups_fname, file_format)
         print(f"[INFO] Saving group_data to '{groups_fname}'.")
-        self.group_data.to_csv(groups_fname)
+        _write_data(self.group_data, groups_fname, file_format)
 
     def load_data(
         self,
         tiles_fname: str | None = "nls_tilelayers.csv",
         groups_fname: str | None = "nls_grouplayers.csv",
     ):
-        """Loads csv files containing the tilelayer and group layer data.
+        """Loads csv or parquet files containing the tilelayer and group layer data.
 
         Parameters
         ----------
@@ -198,12 +394,14 @@ class TileLayerFinder:
         If your data is over a few months old, it may be worth re-creating your csv file using the ``.get_data()`` method.
         """
 
-        tile_data = pd.read_csv(tiles_fname, index_col=0)
+        tile_data = _read_data(tiles_fname)
         self.tile_data = tile_data
 
-        group_data = pd.read_csv(groups_fname, index_col=0)
+        group_data = _read_data(groups_fname)
         self.group_data = group_data
 
+        self._index_data()
+
     def list_tilelayers(self):
         """Print the names and titles of available tilelayers."""
         tilelayers = list(self.tile_data["Name"])
@@ -219,6 +417,7 @@ class TileLayerFinder:
         name: str,
         bbox: tuple | None = None,
         srsname: str | None = "urn:x-ogc:def:crs:EPSG:4326",
+        minify: bool | None = False,
     ):
         """Create a .json file containing the metadata for the named tilelayer/group layer.
 
@@ -233,28 +432,27 @@ class TileLayerFinder:
         srsname : Optional[str], optional
             The spatial reference system (EPSG code) to request the data in.
             By default, "urn:x-ogc:def:crs:EPSG:4326".
+        minify : Optional[bool], optional
+            Whether to remove whitespace from the .json file (uses ``orjson`` if installed, falling back to ``json``).
+            Numbers may be re-formatted (e.g. ``1e-05`` with ``json`` vs ``0.00001`` with ``orjson``)
+            and ``orjson`` reads integers wider than 64 bits as floats.
+            By default, False.
         """
-        if name in list(self.tile_data["Name"]):
-            typename = self.tile_data[self.tile_data["Name"] == name]["Typename"].item()
+        if name in self._tile_index:
+            typename, xyz, max_z = self._tile_index[name]
             print(f"[INFO] Getting metadata for {name} (typename: '{typename}')")
-            xyz = self.tile_data[self.tile_data["Name"] == name]["XYZ URL"].item()
             print(f"[INFO] XYZ URL for this layer is: '{xyz}'")
-            max_z = self.tile_data[self.tile_data["Name"] == name]["Max Z"].item()
             print(f"[INFO] Max zoom level for this layer is: {max_z}")
-        elif name in list(self.group_data["Name"]):
-            typename = self.group_data[self.group_data["Name"] == name][
-                "Typename"
-            ].item()
+        elif name in self._group_index:
+            typename = self._group_index[name]
             print(f"[INFO] Getting metadata for {name} (typename: '{typename}')")
         else:
             msg = f'"{name}" not found in data.'
             raise ValueError(msg)
 
-        try:
-            self.wfs.contents[typename]
-        except KeyError as err:
+        if typename not in self.wfs_contents:
             msg = "[ERROR] The metadata for this tilelayer is unavailable."
-            raise KeyError(msg) from err
+            raise KeyError(msg)
 
         if not bbox:
             try:
@@ -272,14 +470,18 @@ class TileLayerFinder:
 
         print(f"[INFO] Writing to file: './{name}.json'")
         with open(f"{name}.json", "wb") as f:
-            f.write(wfs_feature.getbuffer())
+            if minify:
+                f.write(_minify_json(wfs_feature.getvalue()))
+            else:
+                f.write(wfs_feature.getbuffer())
 
     def get_wfs(
         self,
         url: str | None = "https://geoserver.nls.uk/geoserver/wfs",
         version: str | None = "1.1.0",
+        wait: bool | None = True,
     ):
-        """Get the WFS and save to `self.wfs`.
+        """Get the WFS and save to `self.wfs` (along with its typenames to `self.wfs_contents`).
 
         Parameters
         ----------
@@ -287,9 +489,42 @@ class TileLayerFinder:
             The URL of the WFS, by default 'https://geoserver.nls.uk/geoserver/wfs'
         version : Optional[str], optional
             The version of the WFS to use, by default '1.1.0'
+        wait : Optional[bool], optional
+            Whether to wait for the WFS to load.
+            If False, the WFS is loaded in the background and accessing `self.wfs` waits for it to finish.
+            By default, True.
         """
-        wfs = WebFeatureService(url, version)
-        self.wfs = wfs
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._wfs_future = executor.submit(WebFeatureService, url, version)
+        executor.shutdown(wait=False)
+        if wait:
+            self._wait_for_wfs()
+
+    def _wait_for_wfs(self):
+        """Wait for the WFS to load and save to `self._wfs`, along with its contents (typenames) to `self._wfs_contents`."""
+        if self._wfs_future is not None:
+            self._wfs = self._wfs_future.result()
+            self._wfs_contents = frozenset(self._wfs.contents)
+            self._wfs_future = None
+
+    @property
+    def wfs(self) -> WebFeatureService:
+        """The WFS, waiting for it to load if it is being fetched in the background."""
+        self._wait_for_wfs()
+        return self._wfs
+
+    @wfs.setter
+    def wfs(self, wfs: WebFeatureService):
+        # replaces any WFS still loading in the background
+        self._wfs_future = None
+        self._wfs = wfs
+        self._wfs_contents = frozenset(wfs.contents)
+
+    @property
+    def wfs_contents(self) -> frozenset[str]:
+        """The typenames of the layers available on the WFS."""
+        self._wait_for_wfs()
+        return self._wfs_contents
 
     def print_found_queries(self):
         """Print the names of previously queried tilelayers.
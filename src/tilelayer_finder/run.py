@@ -23,6 +23,14 @@ def main():
         default="nls_group_layers.csv",
         help="Name to use when saving output group layer file",
     )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        choices=["csv", "parquet"],
+        default="csv",
+        help="Format to use when saving output files",
+    )
     parser.add_argument(
         "-n",
         "--name",
@@ -36,7 +44,11 @@ def main():
     # run tilelayer_finder
     tsf = finder.TileLayerFinder()
     tsf.get_data(clean=args.clean)
-    tsf.save_data(tiles_fname=args.tiles_output, groups_fname=args.groups_output)
+    tsf.save_data(
+        tiles_fname=args.tiles_output,
+        groups_fname=args.groups_output,
+        file_format=args.format,
+    )
 
     # save metadata if any names are passed
     if len(args.name) > 0:
@@ -0,0 +1,39 @@
+from tilelayer_finder.finder import TileLayerFinder
+
+
+def _extract_tile_data(tilelayers_dict):
+    # bypass __init__ to avoid fetching the WFS
+    tlf = TileLayerFinder.__new__(TileLayerFinder)
+    tlf.tilelayers_dict = tilelayers_dict
+    tlf.group_layers_dict = {}
+    tlf._extract_data(clean=False)
+    return tlf.tile_data.set_index("Name")
+
+
+def test_extract_data_multi_line_layer():
+    body = """new ol.layer.Tile({
+	title: "Great Britain - OS One Inch, 1885-1900 - Outline",
+	typename: 'nls:Scotland_1inch_2nd_ed',
+	source: new ol.source.XYZ({
+		url: 'https://mapseries-tilesets.s3.amazonaws.com/1inch_2nd_ed/{z}/{x}/{y}.png',
+		maxZ: 15
+	}),
+   })"""
+    row = _extract_tile_data({"oneinch2nd": body}).loc["oneinch2nd"]
+    assert row.to_dict() == {
+        "Title": "Great Britain - OS One Inch, 1885-1900 - Outline",
+        "Typename": "nls:Scotland_1inch_2nd_ed",
+        "XYZ URL": "https://mapseries-tilesets.s3.amazonaws.com/1inch_2nd_ed/{z}/{x}/{y}.png",
+        "Max Z": 15,
+    }
+
+
+def test_extract_data_single_line_layer():
+    body = "new ol.layer.Tile({title: 'A', typename: 'nls:x', source: new ol.source.XYZ({url: 'https://a/{z}.png', maxZ: 9}),})"
+    row = _extract_tile_data({"a": body}).loc["a"]
+    assert row.to_dict() == {
+        "Title": "A",
+        "Typename": "nls:x",
+        "XYZ URL": "https://a/{z}.png",
+        "Max Z": 9,
+    }